@@ -26,31 +26,237 @@ symbols by:
 3.  Reading platform-specific lists of exported symbols.
 4.  Reading an optional user-provided file of additional allowed symbols.
 
-It then compares the nanoapp's undefined symbols (extracted using the corresponding
-elf reader of the target) against this allowed list and reports any discrepancies,
-exiting with an error if unresolvable symbols are found.
+It then compares the nanoapp's undefined symbols (extracted from the dynamic
+symbol table with pyelftools, or with the elf reader of the target as a
+fallback) against this allowed list and reports any discrepancies, exiting with
+an error if unresolvable symbols are found.
 """
 
 import argparse
+import concurrent.futures
+import functools
+import hashlib
+import mmap
 import os
+import pickle
 import re
 import subprocess
+import tempfile
 import warnings
 from os import listdir
 from os.path import join
 
 import pyclibrary
+from elftools.common.exceptions import ELFError
+from elftools.elf.elffile import ELFFile
 
 from shell_util import warning, log_w, success
 
+# libclang parses headers natively and is much faster than pyclibrary, which is
+# used as a fallback when libclang or the clang builtin headers are not available.
+try:
+  from clang import cindex
+except ImportError:
+  cindex = None
+
 # The number of rows to discard from the output of the elf reader
 NUM_ROWS_TO_DISCARD = 4
 
+# pyclibrary cannot find functions that
+#  - have a vararg parameter
+#  - have a trailing macro
+# so removing them from the header file before parsing
+HEADER_REPLACEMENTS = {r', \.\.\.': '', r'[A-Z_]+;': ';'}
+
+# Matches C comments, which are removed before extracting declarations
+COMMENT_PATTERN = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+
+# Matches the parts of a header file pyclibrary needs to find functions:
+# 1. Preprocessor directives, including their continuation lines
+# 2. Inline function definitions, capturing the signature without the body
+# 3. Statements with a parameter list, i.e. likely function declarations
+DECLARATION_PATTERN = re.compile(
+  r'^[ \t]*#(?:.*\\\n)*.*$'
+  r'|^([^#;{}]*\([^;{}]*\))\s*\{(?:[^{}]|\{(?:[^{}]|\{[^{}]*\})*\})*\}'
+  r'|^[^#;{}]*\([^;{}]*\)[^;{}]*;', re.MULTILINE)
+
+# Macros that the CHRE API headers require the implementation to define. Their
+# values don't matter for finding the declared functions.
+LIBCLANG_DEFINES = ['-DCHRE_MESSAGE_TO_HOST_MAX_SIZE=4000']
+
+# The directory caching the functions parsed from each header file
+HEADER_CACHE_DIR = os.path.expanduser('~/.cache/chre_symbolcheck')
+
+# Regex to match both macro forms:
+# 1. ADD_EXPORTED_SYMBOL(internal_name, "external_name") - Captures 'external_name'
+# 2. ADD_EXPORTED_C_SYMBOL(function_name) - Captures 'function_name'
+EXPORTED_SYMBOL_PATTERN = re.compile(
+  rb'ADD_EXPORTED_SYMBOL\s*\([^,]+,\s*"([^"]+)"\)|'
+  rb'ADD_EXPORTED_C_SYMBOL\s*\(\s*([A-Za-z_][A-Za-z0-9_]*)\s*\)')
+
 
 def _get_env_list(env_var_name: str):
   return os.getenv(env_var_name).split(":") if env_var_name in os.environ else []
 
 
+def _get_chre_api_path() -> str:
+  return f"{os.environ['ANDROID_BUILD_TOP']}/system/chre/chre_api/include/chre_api"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_clang_builtin_include_dir():
+  """Returns the directory of clang's builtin headers, or None if not found.
+
+  The libclang wheel doesn't ship headers such as stdbool.h and stdarg.h, which
+  the CHRE API headers include. They are taken from the resource directory set
+  in CHRE_CLANG_RESOURCE_DIR, or otherwise from the one of the installed clang.
+  """
+  resource_dir = os.getenv('CHRE_CLANG_RESOURCE_DIR')
+  if not resource_dir:
+    try:
+      resource_dir = subprocess.run(['clang', '-print-resource-dir'], capture_output=True,
+                                    text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+      return None
+  include_dir = os.path.join(resource_dir, 'include')
+  return include_dir if os.path.isfile(os.path.join(include_dir, 'stdbool.h')) else None
+
+
+@functools.lru_cache(maxsize=None)
+def _get_libclang_index():
+  """Returns a libclang index, or None if libclang cannot be used.
+
+  Without clang's builtin headers most CHRE API headers fail to parse, so
+  pyclibrary is used directly instead of parsing every header twice.
+  """
+  if cindex is None or _get_clang_builtin_include_dir() is None:
+    return None
+  try:
+    return cindex.Index.create()
+  except cindex.LibclangError:
+    return None
+
+
+def _extract_declarations(header_file: str) -> str:
+  """Extracts preprocessor directives and likely function declarations.
+
+  Types, enums and structs are dropped so that pyclibrary only tokenizes the
+  parts of the header file that can declare functions.
+
+  Args:
+    header_file: The path to the header file.
+
+  Returns:
+    The extracted parts of the header file, one per line.
+  """
+  with open(header_file) as f:
+    text = COMMENT_PATTERN.sub('', f.read())
+  # Inline function definitions are turned into declarations
+  return '\n'.join(m.group(1) + ';' if m.group(1) else m.group(0)
+                   for m in DECLARATION_PATTERN.finditer(text))
+
+
+def _parse_header(header_file: str) -> tuple:
+  """Parses the functions declared in a header file.
+
+  Uses libclang when it is available and falls back to pyclibrary otherwise, or
+  when libclang reports errors, e.g. on a trailing macro defined in a header
+  that is not on the include path, as libclang silently drops the declarations
+  it cannot parse.
+
+  Args:
+    header_file: The path to the header file.
+
+  Returns:
+    A tuple containing:
+      - A list of function names declared in the header file.
+      - A list of the header files it includes, which the result depends on.
+  """
+  index = _get_libclang_index()
+  if index is None:
+    return _parse_header_with_pyclibrary(header_file), []
+
+  tu = index.parse(header_file, args=['-x', 'c', f'-I{_get_chre_api_path()}',
+                                     '-isystem', _get_clang_builtin_include_dir(),
+                                     *LIBCLANG_DEFINES])
+  if any(d.severity >= cindex.Diagnostic.Error for d in tu.diagnostics):
+    return _parse_header_with_pyclibrary(header_file), []
+
+  # Only keep the functions declared by the header file itself, not the ones
+  # declared by the files it includes.
+  fnames = [
+    c.spelling for c in tu.cursor.get_children()
+    if c.kind == cindex.CursorKind.FUNCTION_DECL and c.location.file
+       and c.location.file.name == header_file
+  ]
+  return fnames, sorted({i.include.name for i in tu.get_includes()})
+
+
+def _parse_header_with_pyclibrary(header_file: str) -> list:
+  """Parses the functions declared in a header file with pyclibrary.
+
+  Args:
+    header_file: The path to the header file.
+
+  Returns:
+    A list of function names declared in the header file.
+  """
+  with tempfile.NamedTemporaryFile('w', suffix='.h') as declarations:
+    declarations.write(_extract_declarations(header_file))
+    declarations.flush()
+    # suppress warnings from pyclibrary parsing headers
+    with warnings.catch_warnings():
+      warnings.simplefilter('ignore', SyntaxWarning)
+      pyc_parser = pyclibrary.CParser(declarations.name,
+                                      replace=HEADER_REPLACEMENTS)
+  return list(pyc_parser.defs['functions'].keys())
+
+
+def _parse_header_cached(header_file: str) -> list:
+  """Returns the names of the functions declared in a header file.
+
+  Parsing is slow, so the result is cached under HEADER_CACHE_DIR and reused as
+  long as neither the header file nor the files it includes through libclang
+  are modified. This function runs in worker processes, so it must stay at the
+  module level.
+
+  Args:
+    header_file: The path to the header file.
+
+  Returns:
+    A list of function names declared in the header file.
+  """
+  mtime = os.stat(header_file).st_mtime_ns
+  # The cached result is invalidated when the way of parsing changes
+  parse_config = (_get_libclang_index() is not None and _get_clang_builtin_include_dir(),
+                  LIBCLANG_DEFINES, HEADER_REPLACEMENTS, DECLARATION_PATTERN.pattern)
+  cache_file = os.path.join(
+    HEADER_CACHE_DIR,
+    hashlib.sha1(os.path.realpath(header_file).encode()).hexdigest() + '.pkl')
+  try:
+    with open(cache_file, 'rb') as f:
+      cached_mtime, cached_parse_config, include_mtimes, fnames = pickle.load(f)
+    if (cached_mtime == mtime and cached_parse_config == parse_config and
+        all(os.stat(path).st_mtime_ns == include_mtime
+            for path, include_mtime in include_mtimes)):
+      return fnames
+  except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+    pass
+
+  fnames, includes = _parse_header(header_file)
+  try:
+    include_mtimes = [(path, os.stat(path).st_mtime_ns) for path in includes]
+    os.makedirs(HEADER_CACHE_DIR, exist_ok=True)
+    # Write to a temporary file first as other workers may read the cache
+    tmp_file = f"{cache_file}.{os.getpid()}"
+    with open(tmp_file, 'wb') as f:
+      pickle.dump((mtime, parse_config, include_mtimes, fnames), f)
+    os.replace(tmp_file, cache_file)
+  except OSError:
+    pass
+  return fnames
+
+
 def _get_known_exported_functions() -> list:
   """Extracts function names from ADD_EXPORTED_SYMBOL or ADD_EXPORTED_C_SYMBOL macros.
 
@@ -59,28 +265,40 @@ def _get_known_exported_functions() -> list:
   """
   exported_names = []
 
-  # Regex to match both macro forms:
-  # 1. ADD_EXPORTED_SYMBOL(internal_name, "external_name") - Captures 'external_name'
-  # 2. ADD_EXPORTED_C_SYMBOL(function_name) - Captures 'function_name'
-  regex = r'ADD_EXPORTED_SYMBOL\s*\([^,]+,\s*"([^"]+)"\)|' \
-          r'ADD_EXPORTED_C_SYMBOL\s*\(\s*([A-Za-z_][A-Za-z0-9_]*)\s*\)'
-
   exported_macro_files = _get_env_list("EXPORTED_MACRO_FILES")
   for file in exported_macro_files:
     symbols = []
-    with open(file, 'r') as f:
-      for line in f:
-        matches = re.search(regex, line)
-        if matches:
-          name_from_symbol, name_from_c_symbol = matches.groups()
-          symbols.append(name_from_symbol if name_from_symbol else name_from_c_symbol)
+    with open(file, 'rb') as f:
+      # mmap cannot map an empty file
+      if os.fstat(f.fileno()).st_size > 0:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+          for matches in EXPORTED_SYMBOL_PATTERN.finditer(buf):
+            name_from_symbol, name_from_c_symbol = matches.groups()
+            symbols.append(
+              (name_from_symbol if name_from_symbol else name_from_c_symbol).decode())
 
     print(f"{len(symbols)} dynamic symbols found in {file}")
     exported_names.extend(symbols)
   return exported_names
 
 
-def _get_allowed_symbols() -> list:
+def _split_wildcard_symbols(symbols: list) -> tuple:
+  """Separates exact symbol names from wildcard symbols ending with '*'.
+
+  Args:
+    symbols: A list of allowed symbol names, some of which may contain '*'.
+
+  Returns:
+    A tuple containing:
+      - A set of the exact symbol names.
+      - A tuple of the prefixes preceding '*' in the wildcard symbols.
+  """
+  exact = {s for s in symbols if '*' not in s}
+  prefixes = tuple(s[:s.index('*')] for s in symbols if '*' in s)
+  return exact, prefixes
+
+
+def _get_allowed_symbols() -> tuple:
   """Gathers all allowed symbols from CHRE API and platform sources.
 
   This function aggregates symbols from several sources:
@@ -90,9 +308,10 @@ def _get_allowed_symbols() -> list:
   - A platform-specific symbol list file (e.g., dl_base_symbols.lst).
 
   Returns:
-      A list of all allowed symbol names.
+      A tuple of the set of exact allowed symbol names and the tuple of
+      allowed wildcard prefixes, as returned by _split_wildcard_symbols.
   """
-  chre_api_path = f"{os.environ['ANDROID_BUILD_TOP']}/system/chre/chre_api/include/chre_api"
+  chre_api_path = _get_chre_api_path()
   header_files = []
   for f in listdir(chre_api_path + '/chre'):
     header_files.append(join(chre_api_path + '/chre', f))
@@ -100,18 +319,10 @@ def _get_allowed_symbols() -> list:
   header_files.extend(_get_env_list('EXTERNAL_SYMBOL_DECLARATIONS'))
   fnames = []
 
-  # suppress warnings from pyclibrary parsing headers
-  warnings.simplefilter('ignore', SyntaxWarning)
-  try:
-    for h in header_files:
-      # pyclibrary cannot find functions that
-      #  - have a vararg parameter
-      #  - have a trailing macro
-      # so removing them from the header file before parsing
-      pyc_parser = pyclibrary.CParser(h, replace={r', \.\.\.': '', r'[A-Z_]+;': ';'})
-      fnames.extend(list(pyc_parser.defs['functions'].keys()))
-  finally:
-    warnings.simplefilter('default', SyntaxWarning)
+  # Headers are independent of each other so they are parsed in parallel
+  with concurrent.futures.ProcessPoolExecutor() as executor:
+    for header_fnames in executor.map(_parse_header_cached, header_files):
+      fnames.extend(header_fnames)
 
   print(f"{len(fnames)} dynamic symbols found in chre header files")
 
@@ -120,18 +331,47 @@ def _get_allowed_symbols() -> list:
   lst_files = _get_env_list("EXTERNAL_SYMBOL_LISTS")
   for lst_file in lst_files:
     with open(lst_file) as f:
-      platform_external_symbols = [s.strip() for s in f.readlines()]
+      platform_external_symbols = [s.strip() for s in f]
       print(
         f"{len(platform_external_symbols)} dynamic symbols found in {lst_file}")
       fnames.extend(platform_external_symbols)
-  return fnames
+  return _split_wildcard_symbols(fnames)
+
+
+def _get_symbols_with_elf_reader(elf_reader: str, file_name: str) -> list:
+  """Extracts undefined dynamic symbols using an external ELF reader.
+
+  Args:
+    elf_reader: The path to a readelf compatible tool.
+    file_name: The path to the nanoapp .so file.
+
+  Returns:
+    A list of undefined symbol names found in the nanoapp.
+  """
+  readelf_cmd = [elf_reader, '--dyn-syms', '--wide', file_name]
+
+  symbols = []
+  # Filter the output while the elf reader is still writing it
+  with subprocess.Popen(readelf_cmd, stdout=subprocess.PIPE, text=True) as proc:
+    for _ in range(NUM_ROWS_TO_DISCARD):
+      next(proc.stdout, None)
+    for line in proc.stdout:
+      words = line.split()
+      idx_type, symbol_name = words[-2:]
+      if "UND" == idx_type:
+        symbols.append(symbol_name)
+
+  if proc.returncode != 0:
+    raise subprocess.CalledProcessError(proc.returncode, readelf_cmd)
+  return symbols
 
 
 def _get_symbols_from_nanoapp(file_name: str) -> list:
   """Extracts undefined dynamic symbols from a nanoapp .so file.
 
-  Uses the ELF reader specified by the CHRE_TARGET_ELF_READER environment
-  variable to inspect the dynamic symbol table of the given file.
+  Reads the .dynsym section of the given file with pyelftools. If the file
+  cannot be parsed, the ELF reader specified by the optional
+  CHRE_TARGET_ELF_READER environment variable is used instead.
 
   Args:
     file_name: The path to the nanoapp .so file.
@@ -139,16 +379,19 @@ def _get_symbols_from_nanoapp(file_name: str) -> list:
   Returns:
     A list of undefined symbol names found in the nanoapp.
   """
-  elf_reader = os.environ['CHRE_TARGET_ELF_READER']
-  readelf_cmd = f"{elf_reader} --dyn-syms --wide {file_name}"
-  out = subprocess.check_output(readelf_cmd.split(), text=True)
+  try:
+    with open(file_name, 'rb') as f:
+      dynsym = ELFFile(f).get_section_by_name('.dynsym')
+      symbols = [] if dynsym is None else [
+        s.name for s in dynsym.iter_symbols()
+        if s.name and s['st_shndx'] == 'SHN_UNDEF'
+      ]
+  except ELFError:
+    elf_reader = os.getenv('CHRE_TARGET_ELF_READER')
+    if not elf_reader:
+      raise
+    symbols = _get_symbols_with_elf_reader(elf_reader, file_name)
 
-  symbols = []
-  for line in out.splitlines()[NUM_ROWS_TO_DISCARD:]:
-    words = line.split()
-    idx_type, symbol_name = words[-2:]
-    if "UND" == idx_type:
-      symbols.append(symbol_name)
   print(f"{len(symbols)} dynamic symbols found in {file_name}")
   return symbols
 
@@ -165,30 +408,32 @@ def _get_allowed_symbols_from_file(filename: str) -> list:
     A list of symbol names.
   """
   with open(filename) as f:
-    return [s.strip() for s in f.readlines()]
+    return [s.strip() for s in f]
 
 
-def _disallowed_symbols(observed_symbols: list, allowed_symbols: list) -> list:
-  """Compares observed symbols against a list of allowed symbols.
+def _disallowed_symbols(observed_symbols: list, allowed_set: set,
+                        wildcard_prefixes: tuple) -> list:
+  """Compares observed symbols against the allowed symbols.
 
-  Calculates the set difference between observed and allowed symbols. It also
-  handles basic wildcard matching for allowed symbols that end with '*'.
+  A symbol is allowed if it is one of the exact allowed symbols or if it starts
+  with the prefix of a wildcard allowed symbol ending with '*'.
 
   Args:
     observed_symbols: A list of symbols found in the nanoapp.
-    allowed_symbols: A list of all allowed symbols.
+    allowed_set: A set of all exact allowed symbols.
+    wildcard_prefixes: A tuple of the allowed wildcard prefixes.
 
   Returns:
     A list of symbols that are observed but not allowed.
   """
-  diff_list = list(set(observed_symbols) - set(allowed_symbols))
-  # See if any of the wildcard ending allowed symbols will cause some more of
-  # the observed symbols to be allowed
-  for allowed in allowed_symbols:
-    if '*' in allowed:
-      prefix = allowed[:allowed.find('*')]
-      diff_list = [sym for sym in diff_list if not sym.startswith(prefix)]
-  return diff_list
+  diff_set = set(observed_symbols) - allowed_set
+  # Skip the wildcard matching when the exact symbols already cover everything
+  if not diff_set or not wildcard_prefixes:
+    return list(diff_set)
+
+  # Match all the wildcard prefixes in one pass with an anchored alternation
+  wildcard_re = re.compile('|'.join(sorted({re.escape(p) for p in wildcard_prefixes})))
+  return [sym for sym in diff_set if not wildcard_re.match(sym)]
 
 
 if __name__ == '__main__':
@@ -206,14 +451,18 @@ if __name__ == '__main__':
   specific_allowed_symbols_file = args.allowed_symbols_file
 
   observed_symbols = _get_symbols_from_nanoapp(nanoapp_filename)
-  allowed_symbols = _get_allowed_symbols()
+  # The allowed set is built once and extended in place
+  allowed_set, wildcard_prefixes = _get_allowed_symbols()
 
   if specific_allowed_symbols_file is not None:
-    allowed_symbols += _get_allowed_symbols_from_file(
-      specific_allowed_symbols_file)
+    specific_symbols, specific_prefixes = _split_wildcard_symbols(
+      _get_allowed_symbols_from_file(specific_allowed_symbols_file))
+    allowed_set.update(specific_symbols)
+    wildcard_prefixes += specific_prefixes
 
   disallowed_symbols_list = _disallowed_symbols(observed_symbols,
-                                                allowed_symbols)
+                                                allowed_set,
+                                                wildcard_prefixes)
 
   if len(disallowed_symbols_list) > 0:
     warning(f"{len(disallowed_symbols_list)} unresolvable symbol(s) found:\n")
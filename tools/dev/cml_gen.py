@@ -29,8 +29,23 @@ import argparse
 import os
 import re
 import subprocess
+from collections.abc import Iterable, Iterator
+from functools import lru_cache
 from shell_util import fatal_error
 
+# Matches the source file compiled by a compilation command
+SRC_FILE_PATTERN = re.compile(r'-c (\S+) -o')
+
+# Splits a command into terms, treating backslash-prefixed space as space literal
+TERM_SEPARATOR_PATTERN = re.compile(r'(?<!\\) ')
+
+# Splits an include path, macro or warning flag term into its prefix, name and
+# optional '=value' part
+TERM_PATTERN = re.compile(r'^(-[DWI])([^=]*)(=.*)?$')
+
+# Removes backslashes and single quotes, and escapes parentheses
+CLEAN_TERM_TABLE = str.maketrans({'\\': None, "'": None, '(': '\\(', ')': '\\)'})
+
 
 def _write_header(output, project_name):
   """Writes the initial boilerplate for a CMakeLists.txt file.
@@ -39,11 +54,11 @@ def _write_header(output, project_name):
     output: A file-like object to write to.
     project_name: The name of the CMake project.
   """
-  output.write('cmake_minimum_required(VERSION 3.12)\n')
-  output.write(f'project({project_name})\n')
-  output.write('set(CMAKE_C_COMPILER "/usr/bin/clang")\n')
-  output.write('set(CMAKE_CXX_COMPILER "/usr/bin/clang++")\n')
-  output.write('\n')
+  output.write('cmake_minimum_required(VERSION 3.12)\n'
+               f'project({project_name})\n'
+               'set(CMAKE_C_COMPILER "/usr/bin/clang")\n'
+               'set(CMAKE_CXX_COMPILER "/usr/bin/clang++")\n'
+               '\n')
 
 
 def _find_header_files(root_path):
@@ -53,23 +68,51 @@ def _find_header_files(root_path):
       root_path (str): The root directory to start the traversal from.
 
   Returns:
-      list: A list containing the real paths of all *.h files found.
-            Returns an empty list if no *.h files are found or if the
-            root path is invalid.
+      set: A set containing the real paths of all *.h files found, so that
+           symbolic links to the same file are only listed once.
+           Returns an empty set if no *.h files are found or if the
+           root path is invalid.
   """
-  header_files = []
+  header_files = set()
   if not os.path.isdir(root_path):
     print(f"Error: '{root_path}' is not a valid directory.")
     return header_files
 
-  for dirpath, dirnames, filenames in os.walk(root_path):
-    for filename in filenames:
-      if filename.endswith('.h'):
-        real_path = os.path.realpath(os.path.join(dirpath, filename))
-        header_files.append(real_path)
+  header_files.update(_iter_header_files(root_path, os.path.realpath(root_path)))
   return header_files
 
 
+def _iter_header_files(dir_path, real_dir_path):
+  """Recursively yields the real paths of the *.h files under a directory.
+
+  Symbolic links to directories are not followed, so the real path of a
+  subdirectory is derived from the real path of its parent and only symbolic
+  links to files need to be resolved individually. Directories that cannot be
+  read are skipped, like os.walk does.
+
+  Args:
+      dir_path (str): The directory to scan.
+      real_dir_path (str): The real path of dir_path.
+
+  Yields:
+      str: The real path of each *.h file found.
+  """
+  try:
+    entries = os.scandir(dir_path)
+  except OSError:
+    return
+  with entries:
+    for entry in entries:
+      if entry.is_dir(follow_symlinks=False):
+        yield from _iter_header_files(entry.path,
+                                      os.path.join(real_dir_path, entry.name))
+      elif entry.name.endswith('.h'):
+        if entry.is_symlink():
+          yield os.path.realpath(entry.path)
+        else:
+          yield os.path.join(real_dir_path, entry.name)
+
+
 def _write_src_files(output, src_files):
   """Writes the list of source files to the CMakeLists.txt file.
 
@@ -80,9 +123,7 @@ def _write_src_files(output, src_files):
   if not src_files:
     return
 
-  output.write('list (APPEND SOURCE_FILES\n    ')
-  output.write('\n    '.join(src_files))
-  output.write('\n)\n\n')
+  output.write('list (APPEND SOURCE_FILES\n    ' + '\n    '.join(src_files) + '\n)\n\n')
 
 
 def _write_inc_paths(output, inc_paths):
@@ -90,11 +131,10 @@ def _write_inc_paths(output, inc_paths):
 
   Args:
     output: A file-like object to write to.
-    inc_paths: A list of include directory paths.
+    inc_paths: A list of include directory paths, which are quoted when written.
   """
-  output.write('include_directories(\n    ')
-  output.write('\n    '.join(inc_paths))
-  output.write('\n)\n\n')
+  output.write('include_directories(\n    ' +
+               '\n    '.join(f'"{p}"' for p in inc_paths) + '\n)\n\n')
 
 
 def _write_flags(output, flags):
@@ -104,12 +144,11 @@ def _write_flags(output, flags):
     output: A file-like object to write to.
     flags: A dictionary of compiler flags.
   """
-  for key, val in flags.items():
-    output.write(f'set(CMAKE_C_FLAGS "${{CMAKE_C_FLAGS}} {key}{val}")\n')
-
-  for key, val in flags.items():
-    output.write(f'set(CMAKE_CXX_FLAGS "${{CMAKE_CXX_FLAGS}} {key}{val}")\n')
-  output.write('\n')
+  lines = [f'set(CMAKE_C_FLAGS "${{CMAKE_C_FLAGS}} {key}{val}")'
+           for key, val in flags.items()]
+  lines += [f'set(CMAKE_CXX_FLAGS "${{CMAKE_CXX_FLAGS}} {key}{val}")'
+            for key, val in flags.items()]
+  output.write('\n'.join(lines + ['', '']))
 
 
 def _write_macros(output, macros):
@@ -119,9 +158,8 @@ def _write_macros(output, macros):
     output: A file-like object to write to.
     macros: A dictionary of macro definitions.
   """
-  for key, val in macros.items():
-    output.write(f'add_compile_definitions({key}{val})\n')
-  output.write('\n')
+  lines = [f'add_compile_definitions({key}{val})' for key, val in macros.items()]
+  output.write('\n'.join(lines + ['', '']))
 
 
 def _clean_term(term):
@@ -135,16 +173,15 @@ def _clean_term(term):
   Returns:
     The cleaned term.
   """
-  term = re.sub(r'\\', '', term)
-  term = re.sub(r"'", '', term)
-  term = re.sub(r'\(', '\\(', term)
-  term = re.sub(r'\)', '\\)', term)
-  return term
+  return term.translate(CLEAN_TERM_TABLE)
 
 
+@lru_cache(maxsize=None)
 def _convert_to_abs_path(path: str, cwd: str) -> str:
   """Converts a path to an absolute path if it isn't one already.
 
+  The same paths recur on every compilation command so the results are cached.
+
   Args:
     path: The path to convert.
     cwd: The current working directory to resolve relative paths against.
@@ -155,7 +192,36 @@ def _convert_to_abs_path(path: str, cwd: str) -> str:
   return path if os.path.isabs(path) else os.path.abspath(os.path.join(cwd, path))
 
 
-def _parse_compilation_output(args: argparse.Namespace, result: list[str]):
+def _run_build_command(command: str) -> Iterator[str]:
+  """Runs the build command and yields its output as it is produced.
+
+  Exits the script once the output is exhausted if the build command failed.
+
+  Args:
+    command: The build command to run.
+
+  Yields:
+    Each line of the build command's stdout and stderr, without the newline.
+  """
+  last_line = ''
+  # build path should always be the current path. Source path can be different.
+  with subprocess.Popen(
+    command.split(),
+    stdout=subprocess.PIPE,
+    cwd=os.getcwd(),
+    stderr=subprocess.STDOUT,
+    text=True,
+    bufsize=1,
+  ) as proc:
+    for line in proc.stdout:
+      last_line = line.rstrip('\n')
+      yield last_line
+
+  if proc.returncode != 0 or last_line.endswith('Stop.'):
+    fatal_error(f'Failed to build the project:\n{last_line}\n')
+
+
+def _parse_compilation_output(args: argparse.Namespace, result: Iterable[str]):
   """Parses the build command output and generates the CMakeLists.txt file.
 
   Iterates through each line of the build output, extracting source files,
@@ -164,52 +230,51 @@ def _parse_compilation_output(args: argparse.Namespace, result: list[str]):
 
   Args:
     args: The parsed command-line arguments.
-    result: A list of strings, where each string is a line from the build
+    result: An iterable of strings, where each string is a line from the build
       command's stdout.
   """
-  src_files = []
+  src_files = set()
   inc_paths = set()
   macros = dict()
   flags = dict()
 
-  with open(os.path.join(args.output_path, 'CMakeLists.txt'), 'w') as output:
-    _write_header(output, args.project_name)
-
-    for line in result:
-      # Only parse the line compiling a source file
-      src_file = re.search(r'-c (\S+) -o', line)
-      if not src_file:
+  for line in result:
+    # Only parse the line compiling a source file. Most lines are not, so they
+    # are rejected by a cheap substring check before running the regex.
+    if '-c ' not in line or ' -o' not in line:
+      continue
+    src_file = SRC_FILE_PATTERN.search(line)
+    if not src_file:
+      continue
+    else:
+      print('Found src file: ' + src_file.group(1), flush=True)
+
+    # Add source files
+    src_files.add(_convert_to_abs_path(src_file.group(1), args.src_path))
+
+    # treat system include paths as general include paths
+    line = line.replace(' -isystem ', ' -I')
+
+    # Add header files and macros
+    # Treat backslash-prefixed space as space literal in a term
+    for term in TERM_SEPARATOR_PATTERN.split(line):
+      matched_term = TERM_PATTERN.match(_clean_term(term))
+      if not matched_term:
         continue
+      prefix, name, val = matched_term.groups(default='')
+
+      # include paths
+      if prefix == '-I':
+        inc_paths.add(_convert_to_abs_path(name + val, args.src_path))
+      # macros and flags
+      elif prefix == '-D':
+        macros[name] = val
       else:
-        print('Found src file: ' + src_file.group(1), flush=True)
-
-      # Add source files
-      src_files.append(_convert_to_abs_path(src_file.group(1), args.src_path))
-
-      # treat system include paths as general include paths
-      line = re.sub(r' -isystem ', ' -I', line)
-
-      # Add header files and macros
-      # Treat backslash-prefixed space as space literal in a term
-      for term in re.split(r'(?<!\\) ', line):
-        term = _clean_term(term)
-        if not term.startswith('-'):
-          continue
-
-        # include paths
-        if term.startswith('-I'):
-          inc_paths.add(
-            '"{}"'.format(_convert_to_abs_path(term[2:], args.src_path))
-          )
-          continue
-
-        # macros and flags
-        idx = term.find('=')
-        key, val = (term[:idx], term[idx:]) if idx > 0 else (term, '')
-        if term.startswith('-D'):
-          macros[key[2:]] = val
-        elif term.startswith('-W'):
-          flags[key] = val
+        flags[prefix + name] = val
+
+  # The output is only written once the whole build output is parsed
+  with open(os.path.join(args.output_path, 'CMakeLists.txt'), 'w') as output:
+    _write_header(output, args.project_name)
 
     header_files = _find_header_files(args.src_path)
     print(f'{len(header_files)} header files')
@@ -273,20 +338,7 @@ def main():
   print(args)
   print('command: ' + args.command)
 
-  # build path should always be the current path. Source path can be different.
-  result = subprocess.run(
-    args.command.split(),
-    stdout=subprocess.PIPE,
-    cwd=os.getcwd(),
-    stderr=subprocess.STDOUT,
-    check=True,
-    text=True,
-  ).stdout.splitlines()
-
-  if result[-1].endswith('Stop.'):
-    fatal_error(f'Failed to build the project:\n{result[-1]}\n')
-
-  _parse_compilation_output(args, result)
+  _parse_compilation_output(args, _run_build_command(args.command))
 
   return
 
@@ -27,39 +27,54 @@ default value together the action will be incurred before exporting the default
 The result is printed to stdout and piped into the shell to set the environment variables.
 """
 import argparse
+import concurrent.futures
+import functools
+import hashlib
 import json
 import os
 import re
+import shutil
 import subprocess
 import sys
-from typing import Any
 
 from shell_util import log_i, log_w, fatal_error, check_dependencies
 
+# orjson parses JSON faster than the json module but is optional, as this script
+# runs before the python packages of the virtual environment are installed.
+try:
+  from orjson import loads as _json_loads
+except ImportError:
+  _json_loads = json.loads
 
-def _print_env_var_pair(env_var: str):
-  env_name, env_value = re.match(r"(.*)=(.*)", env_var).groups()
-  print(f"\033[32m{env_name}\033[0m = {env_value}", file=sys.stderr)
+# Matches a value only containing dashes and characters in [a-zA-Z0-9_]
+VALUE_PATTERN = re.compile(r"^[\w\-]+$", flags=re.ASCII)
 
+# Matches a list type, capturing the type of its elements, e.g. list[path]
+LIST_TYPE_PATTERN = re.compile(r"^list\[(.*)]$")
 
-def _get_canonical_path(path: str):
-  return os.path.expanduser(os.path.expandvars(path))
+# Matches a <platform_name>-<target_name> combination
+PLATFORM_AND_TARGET_PATTERN = re.compile(r"^\w+-\w+$")
 
+# Where the bare repositories shared by the clones of action_clone_repo are kept
+MIRROR_ROOT = os.path.expanduser("~/.chre_dev/_mirror")
 
-def _init_file(file_path_str: str):
-  from pathlib import Path
 
-  # Define the full path to your desired file
-  file_path = Path(file_path_str)
+def _format_env_var_pair(env_var: str) -> str:
+  env_name, _, env_value = env_var.partition("=")
+  return f"\033[32m{env_name}\033[0m = {env_value}"
+
 
-  # Create the parent directories
-  # parents=True: creates all missing parent folders (like mkdir -p)
-  # exist_ok=True: doesn't raise an error if the directory already exists
-  file_path.parent.mkdir(parents=True, exist_ok=True)
+@functools.lru_cache(maxsize=256)
+def _get_canonical_path(path: str):
+  # The cache must be cleared whenever os.environ is updated
+  return os.path.expanduser(os.path.expandvars(path))
 
-  # Create the file itself
-  # This creates an empty file if it doesn't exist.
-  file_path.touch()
+
+def _init_file(file_path_str: str):
+  # Create the parent directories like mkdir -p, then the file itself if it
+  # doesn't exist
+  os.makedirs(os.path.dirname(file_path_str) or ".", exist_ok=True)
+  open(file_path_str, "a").close()
 
 
 class _CustomArgumentParser(argparse.ArgumentParser):
@@ -93,29 +108,167 @@ def _get_input_from_shell(prompt: str, color: str = None) -> str:
   return input()
 
 
+def _is_clone_of(dest: str, url: str) -> bool:
+  """Checks if 'dest' is a Git repository cloned from 'url'.
+
+  Args:
+      dest (str): The directory to check.
+      url (str): The URL of the Git repository.
+  """
+  # .git is a file instead of a directory if 'dest' is a worktree
+  if not os.path.exists(os.path.join(dest, ".git")):
+    return False
+  result = subprocess.run(
+    ['git', '-C', dest, 'config', '--get', 'remote.origin.url'],
+    capture_output=True, text=True
+  )
+  return result.returncode == 0 and result.stdout.strip() == url
+
+
+def _remove_path(path: str) -> None:
+  """Removes a file, a symbolic link or a directory tree like `rm -rf`."""
+  if os.path.isdir(path) and not os.path.islink(path):
+    shutil.rmtree(path)
+  else:
+    os.remove(path)
+
+
+def _get_mirror_path(url: str) -> str:
+  """Returns the path of the bare repository shared by the clones of 'url'."""
+  return os.path.join(MIRROR_ROOT, hashlib.sha1(url.encode()).hexdigest() + ".git")
+
+
+@functools.lru_cache(maxsize=None)
+def _supports_worktree() -> bool:
+  """Checks if the installed git supports `git worktree`, added in git 2.5."""
+  result = subprocess.run(['git', '--version'], capture_output=True, text=True, check=True)
+  version = re.search(r"(\d+)\.(\d+)", result.stdout)
+  return version is not None and tuple(map(int, version.groups())) >= (2, 5)
+
+
+def _fetch_into_mirror(url: str, branch: str) -> None:
+  """Fetches the latest commit of 'branch' from 'url' into its shared mirror.
+
+  The mirror is created on first use. Every branch is fetched with --depth=1 so
+  only the objects of its latest commit are downloaded.
+
+  Args:
+      url (str): The URL of the Git repository.
+      branch (str): The branch to fetch.
+  """
+  mirror = _get_mirror_path(url)
+  if not os.path.isdir(mirror):
+    subprocess.run(['git', 'init', '--bare', '--quiet', mirror], check=True)
+    subprocess.run(['git', '-C', mirror, 'remote', 'add', 'origin', url], check=True)
+  subprocess.run(
+    ['git', '-C', mirror, 'fetch', '--depth=1', 'origin', f'+{branch}:refs/heads/{branch}'],
+    check=True
+  )
+
+
+def _add_worktree(url: str, branch: str, dest: str) -> None:
+  """Checks out 'branch' of the mirror of 'url' into 'dest' as a worktree.
+
+  Only the files are written as the objects are shared with the mirror. The
+  worktree is detached so that the same branch can be checked out into several
+  destinations and updated by later fetches.
+
+  Args:
+      url (str): The URL of the Git repository.
+      branch (str): The branch to check out, which must have been fetched.
+      dest (str): The destination directory, which must not exist.
+  """
+  mirror = _get_mirror_path(url)
+  # Forget the worktrees whose directories have been removed, including 'dest'
+  subprocess.run(['git', '-C', mirror, 'worktree', 'prune'], check=True)
+  # stdout is reserved for the env variables, so git's progress goes to stderr
+  subprocess.run(
+    ['git', '-C', mirror, 'worktree', 'add', '--detach', dest, f'refs/heads/{branch}'],
+    stdout=sys.stderr, check=True
+  )
+
+
+def _clone_repo(url: str, branch: str, dest: str) -> None:
+  if _supports_worktree():
+    _fetch_into_mirror(url, branch)
+    _add_worktree(url, branch, dest)
+    return
+  # The --single-branch option fetches only the specified branch, and --depth=1 only fetches
+  # its latest commit, saving time and space.
+  subprocess.run(
+    ['git', 'clone', '--branch', branch, '--single-branch', '--depth=1', url, dest],
+    check=True
+  )
+
+
+def _replace_with_clone(url: str, branch: str, dest: str) -> None:
+  """Replaces the existing 'dest' with a clone of 'url'.
+
+  The repository is fetched into its mirror, or cloned into a temporary sibling
+  directory if worktrees are not supported, while 'dest' is being removed, so
+  that the network transfer overlaps with the deletion.
+
+  Args:
+      url (str): The URL of the Git repository.
+      branch (str): The branch to clone.
+      dest (str): The existing destination to replace.
+  """
+  use_worktree = _supports_worktree()
+  tmp_dest = f"{dest}.tmp-{os.getpid()}"
+  with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+    removal = executor.submit(_remove_path, dest)
+    if use_worktree:
+      clone = executor.submit(_fetch_into_mirror, url, branch)
+    else:
+      clone = executor.submit(_clone_repo, url, branch, tmp_dest)
+
+  if removal.exception() is not None or clone.exception() is not None:
+    if os.path.exists(tmp_dest):
+      shutil.rmtree(tmp_dest, ignore_errors=True)
+    if removal.exception() is not None:
+      fatal_error(f"Error removing {dest}: {removal.exception()}")
+    raise clone.exception()
+  if use_worktree:
+    _add_worktree(url, branch, dest)
+  else:
+    os.rename(tmp_dest, dest)
+
+
 def _action_clone_repo(url: str, branch: str, dest: str) -> None:
   """Clones a Git repository from 'url' with a specific 'branch' into 'dest'.
 
+  The clones of the same 'url' share a bare mirror under MIRROR_ROOT and are
+  checked out as its worktrees, so objects already fetched for another branch
+  or destination are not downloaded again. If 'dest' is already a clone of
+  'url', only the latest commit of 'branch' is fetched into it instead of
+  cloning the repository again.
+
   Args:
       url (str): The URL of the Git repository.
       branch (str): The branch to clone.
       dest (str): The destination directory to clone the repository into.
   """
-  if os.path.exists(dest):
-    answer = _get_input_from_shell(
-      f"{dest} already exists. Shall we override it? (y/N):", color="yellow")
-    if not answer or answer.lower() == 'n':
-      log_i(f"Skipping clone operation for {dest}")
-      return
-    log_i(f"Removing existing directory: {dest}")
-    subprocess.run(['rm', '-rf', dest], check=True)
-
+  # git -C <mirror> worktree add resolves a relative 'dest' against the mirror
+  dest = os.path.abspath(dest)
   try:
-    # The --single-branch option fetches only the specified branch, saving time and space.
-    subprocess.run(
-      ['git', 'clone', '--branch', branch, '--single-branch', url, dest],
-      check=True
-    )
+    if not os.path.exists(dest):
+      _clone_repo(url, branch, dest)
+    else:
+      answer = _get_input_from_shell(
+        f"{dest} already exists. Shall we override it? (y/N):", color="yellow")
+      if not answer or answer.lower() == 'n':
+        log_i(f"Skipping clone operation for {dest}")
+        return
+      if _is_clone_of(dest, url):
+        log_i(f"Updating the existing clone: {dest}")
+        subprocess.run(['git', '-C', dest, 'fetch', '--depth=1', 'origin', branch], check=True)
+        # stdout is evaluated by the shell as env variables, so git's output goes to stderr
+        subprocess.run(['git', '-C', dest, 'reset', '--hard', 'FETCH_HEAD'],
+                       stdout=sys.stderr, check=True)
+        log_i(f"Successfully updated {dest} to {url} (branch: {branch})")
+        return
+      log_i(f"Replacing existing directory: {dest}")
+      _replace_with_clone(url, branch, dest)
     log_i(f"Successfully cloned {url} (branch: {branch}) into {dest}")
   except subprocess.CalledProcessError:
     fatal_error('Error cloning repository')
@@ -124,6 +277,72 @@ def _action_clone_repo(url: str, branch: str, dest: str) -> None:
       "Error: 'git' command not found. Please ensure Git is installed and in your PATH.")
 
 
+@functools.lru_cache(maxsize=512)
+def _is_dir(path: str) -> bool:
+  # The cache must be cleared whenever an action may create files
+  return os.path.isdir(path)
+
+
+@functools.lru_cache(maxsize=512)
+def _is_file(path: str) -> bool:
+  # The cache must be cleared whenever an action may create files
+  return os.path.isfile(path)
+
+
+def _get_validation_error(value: str, expanded_value: str, v_type: str):
+  """Validates a single value based on its type.
+
+  Args:
+    value: The value as entered by the user.
+    expanded_value: The value with shell variables expanded.
+    v_type: The type of the value for validation.
+
+  Returns:
+    The error message if the value is invalid, otherwise None.
+  """
+  if v_type == "path":
+    if not _is_dir(expanded_value):
+      return f"Path '{value}' does not exist."
+  elif v_type == "file":
+    if not _is_file(expanded_value):
+      return f"File '{value}' does not exist."
+  elif v_type == "value":
+    if not VALUE_PATTERN.match(value):
+      return f"Invalid value '{value}'. Only dash and characters in [a-zA-Z0-9_] are allowed."
+  else:
+    return f"Unknown value type '{v_type}' for value '{value}'"
+  return None
+
+
+def _validate_values(values: list, expanded_values: list, v_type: str):
+  """Validates a list of values of the same type.
+
+  Checking whether a path or a file exists is I/O bound, which can be slow on
+  network file systems, so duplicated values are only checked once and
+  multiple paths or files are checked concurrently. Other values are matched
+  in memory, where threads would only add overhead.
+
+  Args:
+    values: The values as entered by the user.
+    expanded_values: The values with shell variables expanded.
+    v_type: The type of the values for validation.
+
+  Returns:
+    The error message of the first invalid value, or None if all are valid.
+  """
+  # Keep the first occurrence of each value so the first error stays the same
+  unique_pairs = dict.fromkeys(zip(values, expanded_values))
+  if len(unique_pairs) < len(values):
+    values, expanded_values = map(list, zip(*unique_pairs))
+  v_types = [v_type] * len(values)
+  if v_type in ("path", "file") and len(values) > 1:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(16, len(values))) as executor:
+      errors = list(executor.map(_get_validation_error, values, expanded_values, v_types))
+  else:
+    errors = map(_get_validation_error, values, expanded_values, v_types)
+  return next(filter(None, errors), None)
+
+
 def _assert_and_expand_env_variable(env_name, env_type: str, env_value: str):
   """Expands and validates an environment variable, then sets it.
 
@@ -141,42 +360,42 @@ def _assert_and_expand_env_variable(env_name, env_type: str, env_value: str):
     The expanded value of the environment variable.
   """
 
-  def _check_single_value(value, v_type):
-    _expanded_value = _get_canonical_path(value)
-    if v_type == "path":
-      if not os.path.isdir(_expanded_value):
-        fatal_error(f"Path '{value}' does not exist.")
-    elif v_type == "file":
-      if not os.path.isfile(_expanded_value):
-        fatal_error(f"File '{value}' does not exist.")
-    elif v_type == "value":
-      if not re.match(r"^[\w\-]+$", value, flags=re.ASCII):
-        fatal_error(
-          f"Invalid value '{value}'. Only dash and characters in [a-zA-Z0-9_] are allowed.")
-    else:
-      fatal_error(f"Unknown value type '{v_type}' for value '{value}'")
-    return _expanded_value
-
-  matched_list_type = re.match(r"^list\[(.*)]$", env_type)
+  matched_list_type = LIST_TYPE_PATTERN.match(env_type)
   if matched_list_type:
-    expanded_value = ":".join(
-      _check_single_value(v, matched_list_type.group(1)) for v in env_value.split())
+    values = env_value.split()
+    v_type = matched_list_type.group(1)
   else:
-    expanded_value = _check_single_value(env_value, env_type)
+    values = [env_value]
+    v_type = env_type
+  expanded_values = [_get_canonical_path(v) for v in values]
+  error = _validate_values(values, expanded_values, v_type)
+  if error:
+    fatal_error(error)
+  expanded_value = ":".join(expanded_values)
   os.environ[env_name] = expanded_value
+  # The new variable may be referenced by the following paths
+  _get_canonical_path.cache_clear()
   return expanded_value
 
 
+# Maps the action names usable in default_action to their implementations
+ACTIONS = {
+  "action_clone_repo": _action_clone_repo,
+}
+
+
 def _run_action(action_and_args):
-  try:
-    func = getattr(sys.modules[__name__], "_" + action_and_args[0])
-    expanded_args = [_get_canonical_path(arg) for arg in action_and_args[1:]]
-    func(*expanded_args)
-  except AttributeError:
+  func = ACTIONS.get(action_and_args[0])
+  if func is None:
     fatal_error(f"Unknown action: '{action_and_args[0]}'")
+  expanded_args = [_get_canonical_path(arg) for arg in action_and_args[1:]]
+  func(*expanded_args)
+  # The action may have created the paths that were checked before
+  _is_dir.cache_clear()
+  _is_file.cache_clear()
 
 
-def _load_config(config_file: str = None) -> Any:
+def _load_config(config_file: str = None) -> tuple:
   """Loads and parses the configuration file.
 
   Args:
@@ -185,7 +404,12 @@ def _load_config(config_file: str = None) -> Any:
     so that the default config file can be retrieved.
 
   Returns:
-    A dictionary containing the parsed JSON configuration data.
+    A tuple containing:
+      - A dictionary indexing the parsed JSON configuration data, mapping each
+        (platform_name, target_name) tuple to its (platform, target) config
+        entries. When a combination is listed twice the first entry is kept.
+      - A list of the required fields missing from the entries left out of the
+        index, in the order they are found.
   """
 
   if config_file is None:
@@ -196,21 +420,39 @@ def _load_config(config_file: str = None) -> Any:
     config_file = _get_canonical_path(config_file)
 
   try:
-    with open(config_file, "r") as f:
-      return json.load(f)
+    with open(config_file, "rb") as f:
+      config_data = _json_loads(f.read())
   except FileNotFoundError:
     fatal_error(f"Error: Config file '{config_file}' not found")
-  except json.JSONDecodeError as e:
+  # Both json.JSONDecodeError and orjson.JSONDecodeError are ValueError
+  except ValueError as e:
     fatal_error(f"Error: Invalid JSON format in '{config_file}'\n{e}")
 
+  # Malformed entries are only reported if the requested combination is not
+  # found, so that they don't prevent using the other entries.
+  index = {}
+  missing_fields = []
+  for platform in config_data:
+    for field in ("platform", "targets"):
+      if field not in platform:
+        missing_fields.append(field)
+    for target in platform.get("targets", []):
+      if "name" not in target:
+        missing_fields.append("name")
+      elif "platform" in platform:
+        index.setdefault((platform["platform"], target["name"]), (platform, target))
+  return index, missing_fields
+
 
 def _parse_platform_and_target_configs(
-    config_data: Any, platform_and_target: str
+    config_index: dict, missing_fields: list, platform_and_target: str
 ):
   """Parses config data to find predefined env vars for a platform-target.
 
   Args:
-    config_data: The parsed JSON configuration data.
+    config_index: The indexed configuration data returned by _load_config.
+    missing_fields: The fields missing from malformed entries returned by
+      _load_config.
     platform_and_target: A string in the format "<platform_name>-<target_name>".
 
   Returns:
@@ -218,46 +460,46 @@ def _parse_platform_and_target_configs(
       - A dictionary of predefined environment variables.
       - A list of environment variable definitions to be processed further.
   """
-  supported_combinations = [
-    f"{entry.get('platform')}-{target.get('name')}"
-    for entry in config_data
-    for target in entry.get("targets", [])
-  ]
 
-  if not platform_and_target or not re.match(r"^\w+-\w+$", platform_and_target):
+  def _supported_combinations():
+    return [f"{platform_name}-{target_name}" for platform_name, target_name in config_index]
+
+  if not platform_and_target or not PLATFORM_AND_TARGET_PATTERN.match(platform_and_target):
     fatal_error(
       "platform and target must be in the format of <platform_name-target_name>\n"
-      f"Supported choices are: {supported_combinations}"
+      f"Supported choices are: {_supported_combinations()}"
     )
 
   platform_name, target_name = platform_and_target.split("-")
-  for platform in config_data:
-    try:
-      if platform["platform"] != platform_name:
-        continue
-      for target in platform["targets"]:
-        if target["name"] != target_name:
-          continue
-        env_map = {"CHRE_PLATFORM": platform_name,
-                   "CHRE_TARGET_TYPE": target_name,
-                   "CHRE_BUILD_TARGET": target["build_target"],
-                   "CHRE_DEV_PATH": _get_canonical_path(f"~/.chre_dev/{platform_name}-{target_name}")
-                   }
-        if platform.get("python_version"):
-          env_map["CHRE_PYTHON_VERSION"] = platform.get("python_version")
-        if target.get("install_location"):
-          env_map["TARGET_INSTALL_LOCATION"] = target["install_location"]
-        envs = platform.get("common_env_variables", []) + target.get(
-          "env_variables", [])
-        return env_map, envs
-    except KeyError as e:
+  entry = config_index.get((platform_name, target_name))
+  if entry is None:
+    if missing_fields:
       fatal_error(
-        f"Malformed config for {platform_name}-{target_name}: '{e.args[0]}' field is not defined")
+        f"Malformed config for {platform_name}-{target_name}: "
+        f"'{missing_fields[0]}' field is not defined"
+      )
+    fatal_error(
+      f"No platform-target combination found for '{platform_name}-{target_name}'\n"
+      f"Supported choices are: {_supported_combinations()}"
+    )
 
-  fatal_error(
-    f"No platform-target combination found for '{platform_name}-{target_name}'\n"
-    f"Supported choices are: {supported_combinations}"
-  )
+  platform, target = entry
+  try:
+    env_map = {"CHRE_PLATFORM": platform_name,
+               "CHRE_TARGET_TYPE": target_name,
+               "CHRE_BUILD_TARGET": target["build_target"],
+               "CHRE_DEV_PATH": _get_canonical_path(f"~/.chre_dev/{platform_name}-{target_name}")
+               }
+    if platform.get("python_version"):
+      env_map["CHRE_PYTHON_VERSION"] = platform.get("python_version")
+    if target.get("install_location"):
+      env_map["TARGET_INSTALL_LOCATION"] = target["install_location"]
+    envs = platform.get("common_env_variables", []) + target.get(
+      "env_variables", [])
+    return env_map, envs
+  except KeyError as e:
+    fatal_error(
+      f"Malformed config for {platform_name}-{target_name}: '{e.args[0]}' field is not defined")
 
 
 def _parse_env_variable_fields(env_vars, predefined_envs):
@@ -283,19 +525,21 @@ def _parse_env_variable_fields(env_vars, predefined_envs):
   for env_var in env_vars:
     try:
       env_name = env_var["name"]
+      env_type = env_var["type"]
       if env_name in all_env_names:
         fatal_error(f"Duplicate env variable name: {env_name}")
-      all_env_names.add(f"{env_name}")
+      all_env_names.add(env_name)
       default_value = env_var.get("default")
       default_action = env_var.get("default_action", [])
-      prompt = f"{env_name}"
+      description = env_var.get("description", "")
+      prompt = env_name
       if default_value is not None:
-        prompt = "{} ({})".format(env_name, default_value if default_value else "EMPTY")
-      print("\n{}".format(env_var.get("description", "")), file=sys.stderr)
+        prompt = f"{env_name} ({default_value if default_value else 'EMPTY'})"
+      print(f"\n{description}", file=sys.stderr)
       user_entered_value = _get_input_from_shell(f"{prompt}: ").strip()
 
       if user_entered_value:
-        expanded_value = _assert_and_expand_env_variable(env_name, env_var["type"],
+        expanded_value = _assert_and_expand_env_variable(env_name, env_type,
                                                          user_entered_value)
         env_var_pairs.append(f"{env_name}={expanded_value}")
         # User entered a value, skip the default action
@@ -307,9 +551,16 @@ def _parse_env_variable_fields(env_vars, predefined_envs):
 
       if default_action:
         _run_action(default_action)
+        # A trusted default action guarantees that the path or file it creates
+        # exists, so the default value doesn't need to be validated again.
+        if env_var.get("trusted") and env_type in ("path", "file"):
+          expanded_value = _get_canonical_path(default_value)
+          os.environ[env_name] = expanded_value
+          _get_canonical_path.cache_clear()
+          env_var_pairs.append(f"{env_name}={expanded_value}")
+          continue
       # Default action is supposed to have made the default value valid
-      expanded_value = _assert_and_expand_env_variable(env_name, env_var["type"],
-                                                       default_value)
+      expanded_value = _assert_and_expand_env_variable(env_name, env_type, default_value)
       env_var_pairs.append(f"{env_name}={expanded_value}")
     except KeyError as e:
       fatal_error(f"The environment variable doesn't have the field '{e.args[0]}'")
@@ -320,6 +571,52 @@ def _parse_env_variable_fields(env_vars, predefined_envs):
 
 
 
+def _load_valid_env_var_pairs(env_vars_file: str, env_vars, predefined_envs):
+  """Loads the previously saved env variables if they are all still valid.
+
+  Args:
+    env_vars_file: The file containing the saved <name>=<value> pairs.
+    env_vars: A list of dictionaries, where each dictionary defines an
+      environment variable customizable by the user.
+    predefined_envs: A dict of environment variables pre-defined for the platform
+     and the target.
+
+  Returns:
+    A list of <name>=<value> pairs, or None if any of the saved env variables is
+    missing, outdated or no longer valid.
+  """
+  with open(env_vars_file, "r") as f:
+    env_var_pairs = [line.strip() for line in f if line.strip()]
+  saved_envs = dict(pair.partition("=")[::2] for pair in env_var_pairs)
+
+  if any(saved_envs.get(k) != v for k, v in predefined_envs.items()):
+    return None
+
+  # Group the saved values by type so each type is validated in one batch
+  values_by_type = {}
+  try:
+    for env_var in env_vars:
+      env_name = env_var["name"]
+      if env_name not in saved_envs:
+        return None
+      env_type = env_var["type"]
+      matched_list_type = LIST_TYPE_PATTERN.match(env_type)
+      if matched_list_type:
+        values = [v for v in saved_envs[env_name].split(":") if v]
+        env_type = matched_list_type.group(1)
+      else:
+        values = [saved_envs[env_name]]
+      values_by_type.setdefault(env_type, []).extend(values)
+  except KeyError as e:
+    fatal_error(f"The environment variable doesn't have the field '{e.args[0]}'")
+
+  for v_type, values in values_by_type.items():
+    # Saved values are already expanded
+    if _validate_values(values, values, v_type):
+      return None
+  return env_var_pairs
+
+
 def main():
   """Parses command-line arguments and orchestrates the script's execution."""
   check_dependencies(['cmake', 'protoc', 'pyenv', 'xxd'])
@@ -333,28 +630,43 @@ def main():
   arg_parser.add_argument(
     "-c", "--config", type=str
   )
+  arg_parser.add_argument(
+    "-q", "--quick", action="store_true",
+    help="Reuse the previously entered env variables without prompting if they are still valid"
+  )
 
   args = arg_parser.parse_args()
-  config_data = _load_config(args.config)
-  fixed_env_map, target_envs_configs = _parse_platform_and_target_configs(config_data,
+  config_index, missing_fields = _load_config(args.config)
+  fixed_env_map, target_envs_configs = _parse_platform_and_target_configs(config_index,
+                                                                          missing_fields,
                                                                           args.platform_and_target)
   os.environ.update(fixed_env_map)
+  _get_canonical_path.cache_clear()
 
   env_vars_file = f"{fixed_env_map['CHRE_DEV_PATH']}/env_vars.txt"
 
+  if args.quick and os.path.exists(env_vars_file):
+    env_var_pairs = _load_valid_env_var_pairs(env_vars_file, target_envs_configs, fixed_env_map)
+    if env_var_pairs is not None:
+      log_i("Reusing the previously entered env variables")
+      print("\n".join(env_var_pairs))
+      return
+    log_w("The previously entered env variables are no longer valid\n")
+    # Paths found missing above may be created before they are entered again
+    _is_dir.cache_clear()
+    _is_file.cache_clear()
+
   if os.path.exists(env_vars_file):
     with open(env_vars_file, "r") as f:
-      log_w("The following env variables are previously entered:\n")
-      predefined_vars = []
-      for env_var_pair in f:
-        _print_env_var_pair(env_var_pair)
-        predefined_vars.append(env_var_pair.strip())
-      answer = _get_input_from_shell("\nShall we keep using them? (Y/n):", color="yellow")
-      if not answer or answer.lower() == 'y':
-        print("\n".join(predefined_vars))
-        return
-      else:
-        log_w("Overriding the existing dev environment settings...\n")
+      predefined_vars = f.read().splitlines()
+    log_w("The following env variables are previously entered:\n")
+    sys.stderr.write("".join(_format_env_var_pair(pair) + "\n" for pair in predefined_vars))
+    answer = _get_input_from_shell("\nShall we keep using them? (Y/n):", color="yellow")
+    if not answer or answer.lower() == 'y':
+      print("\n".join(pair.strip() for pair in predefined_vars))
+      return
+    else:
+      log_w("Overriding the existing dev environment settings...\n")
 
   env_var_pairs = _parse_env_variable_fields(target_envs_configs, fixed_env_map)
 
@@ -21,8 +21,10 @@ the compiled and signed binary (.so file) and, for nanoapps, the corresponding
 .napp_header file to the device.
 """
 import argparse
+import glob
 import os
-from shell_util import ShellSession, not_have, has, fatal_error, warning
+import shlex
+from shell_util import ShellSession, get_session, not_have, has, fatal_error, warning
 
 
 def root(session: ShellSession):
@@ -42,7 +44,11 @@ def root(session: ShellSession):
 
 
 if __name__ == '__main__':
-  if not os.getenv("TARGET_INSTALL_LOCATION"):
+  install_location = os.environ.get('TARGET_INSTALL_LOCATION')
+  build_target = os.environ.get('CHRE_BUILD_TARGET')
+  target_type = os.environ.get('CHRE_TARGET_TYPE')
+
+  if not install_location:
     fatal_error("TARGET_INSTALL_LOCATION is not set so the installation will not proceed")
 
   arg_parser = argparse.ArgumentParser(
@@ -54,24 +60,30 @@ if __name__ == '__main__':
 
   args = arg_parser.parse_args()
 
-  bash = ShellSession()
+  patterns = [f"./out/{build_target}/signed/*.so"]
+  if "nanoapp" == target_type:
+    patterns.append(f"./out/{build_target}/*.napp_header")
+
+  # Expand the globs here so that a missing file is reported clearly
+  # before the device is touched
+  binaries = []
+  for pattern in patterns:
+    files = sorted(glob.glob(pattern))
+    if not files:
+      fatal_error(f"No file matches {pattern}, please build the target first")
+    binaries += files
+
+  bash = get_session()
   root(bash)
   run = bash.run
 
-  install_location = os.getenv('TARGET_INSTALL_LOCATION')
-  build_target = os.getenv('CHRE_BUILD_TARGET')
-  target_type = os.getenv('CHRE_TARGET_TYPE')
-
-  run(f"adb shell mkdir -p {install_location}")
-  run(f"adb push ./out/{build_target}/signed/*.so {install_location}",
+  # Push everything with a single adb invocation. This isn't atomic: if the
+  # push fails halfway, the files already copied are left on the device.
+  sources = " ".join(shlex.quote(binary) for binary in binaries)
+  run(f"adb shell mkdir -p {install_location} && adb push {sources} {install_location}",
       not_have("error"),
       show_output=True)
 
-  if "nanoapp" == target_type:
-    run(
-      f"adb push ./out/{build_target}/*.napp_header {install_location}",
-      not_have("error"), show_output=True)
-
   if args.reboot:
     run("adb reboot")
     run("adb wait-for-device")
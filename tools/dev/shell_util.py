@@ -1,5 +1,7 @@
 #!/usr/bin/python3
 
+import functools
+import os
 import re
 import sys
 import time
@@ -7,22 +9,29 @@ import time
 import shutil
 
 
+@functools.lru_cache(maxsize=None)
+def _which(program: str, path: str):
+  # PATH is part of the key so that the cache stays valid if PATH changes
+  return shutil.which(program, path=path)
+
+
 def check_dependencies(required_programs: list[str]):
   """
   Checks if all required command-line tools are installed.
   If a tool is missing, it prints an error and exits the script.
   """
   missing_programs = []
+  path = os.environ.get("PATH")
 
   for program in required_programs:
-    if shutil.which(program) is None:
+    if _which(program, path) is None:
       missing_programs.append(program)
 
   if missing_programs:
-    log_e("ERROR: The following required programs are not installed or not in your PATH:\n")
-    log_e("  " + " ".join(missing_programs))
-
-    log_e("\nPlease install them and/or add them to your PATH")
+    # Reported in a single write so that it isn't interleaved with other output
+    log_e("ERROR: The following required programs are not installed or not in your PATH:\n\n"
+          f"  {' '.join(missing_programs)}\n\n"
+          "Please install them and/or add them to your PATH")
     sys.exit(1)  # Exit with a non-zero status code to indicate an error
 
   log_i("All required programs are found")
@@ -34,40 +43,63 @@ def fatal_error(message: str):
   sys.exit(1)
 
 
+# The banners are written together with the message in a single call instead of
+# one print per line.
+WARNING_BANNER = """\033[33m
+▗▖ ▗▖ ▗▄▖ ▗▄▄▖ ▗▖  ▗▖▗▄▄▄▖▗▖  ▗▖ ▗▄▄▖
+▐▌ ▐▌▐▌ ▐▌▐▌ ▐▌▐▛▚▖▐▌  █  ▐▛▚▖▐▌▐▌   
+▐▌ ▐▌▐▛▀▜▌▐▛▀▚▖▐▌ ▝▜▌  █  ▐▌ ▝▜▌▐▌▝▜▌
+▐▙█▟▌▐▌ ▐▌▐▌ ▐▌▐▌  ▐▌▗▄█▄▖▐▌  ▐▌▝▚▄▞▘
+
+"""
+
+SUCCESS_BANNER = """\033[32m
+▗▄▄▖  ▗▄▖  ▗▄▄▖ ▗▄▄▖
+▐▌ ▐▌▐▌ ▐▌▐▌   ▐▌   
+▐▛▀▘ ▐▛▀▜▌ ▝▀▚▖ ▝▀▚▖
+▐▌   ▐▌ ▐▌▗▄▄▞▘▗▄▄▞▘
+
+"""
+
+
 def warning(message: str):
   """Prints a warning message flag and message in yellow to stderr."""
-  print(f"\033[33m")
-  print("▗▖ ▗▖ ▗▄▖ ▗▄▄▖ ▗▖  ▗▖▗▄▄▄▖▗▖  ▗▖ ▗▄▄▖")
-  print("▐▌ ▐▌▐▌ ▐▌▐▌ ▐▌▐▛▚▖▐▌  █  ▐▛▚▖▐▌▐▌   ")
-  print("▐▌ ▐▌▐▛▀▜▌▐▛▀▚▖▐▌ ▝▜▌  █  ▐▌ ▝▜▌▐▌▝▜▌")
-  print("▐▙█▟▌▐▌ ▐▌▐▌ ▐▌▐▌  ▐▌▗▄█▄▖▐▌  ▐▌▝▚▄▞▘")
-  print("")
-  print(f"{message}\033[0m\n", file=sys.stderr)
+  sys.stderr.write(f"{WARNING_BANNER}{message}\033[0m\n\n")
 
 
 def success(message: str):
-  print(f"\033[32m")
-  print("▗▄▄▖  ▗▄▖  ▗▄▄▖ ▗▄▄▖")
-  print("▐▌ ▐▌▐▌ ▐▌▐▌   ▐▌   ")
-  print("▐▛▀▘ ▐▛▀▜▌ ▝▀▚▖ ▝▀▚▖")
-  print("▐▌   ▐▌ ▐▌▗▄▄▞▘▗▄▄▞▘")
-  print("")
-  print(f"{message}\033[0m")
+  sys.stdout.write(f"{SUCCESS_BANNER}{message}\033[0m\n")
+
+
+# The colors of the logs, as bytes written to the stderr file descriptor
+LOG_ERROR_COLOR = b"\033[31m"
+LOG_WARNING_COLOR = b"\033[33m"
+LOG_COLOR_RESET = b"\033[0m"
+
+
+def _write_log(data: bytes):
+  """Writes a log to the stderr file descriptor without the sys.stderr layer.
+
+  sys.stderr is flushed first so that the log stays after what was written
+  through it.
+  """
+  sys.stderr.flush()
+  os.write(2, data)
 
 
 def log_e(message: str):
   """Prints an error log in red to stderr."""
-  print(f"\033[31m{message}\033[0m", file=sys.stderr)
+  _write_log(LOG_ERROR_COLOR + message.encode() + LOG_COLOR_RESET + b"\n")
 
 
 def log_w(message: str):
   """Prints a warning log in yellow to stderr."""
-  print(f"\033[33m{message}\033[0m", file=sys.stderr)
+  _write_log(LOG_WARNING_COLOR + message.encode() + LOG_COLOR_RESET + b"\n")
 
 
 def log_i(message: str):
   """Prints a log to stderr."""
-  print(f"{message}", file=sys.stderr)
+  _write_log(f"{message}\n".encode())
 
 
 def get_input_from_shell(prompt: str) -> str:
@@ -83,77 +115,324 @@ def get_input_from_shell(prompt: str) -> str:
   return input()
 
 
+# The checks are small callables with their pattern compiled once, as they may
+# run on every retry of ShellSession.run_until_success.
+class _HasMatcher:
+  __slots__ = ("regex",)
+
+  def __init__(self, pattern: str):
+    self.regex = re.compile(pattern, flags=re.IGNORECASE)
+
+  def __call__(self, output: str) -> bool:
+    return self.regex.search(output) is not None
+
+
+class _NotHaveMatcher:
+  __slots__ = ("regex",)
+
+  def __init__(self, pattern: str):
+    self.regex = re.compile(pattern, flags=re.IGNORECASE)
+
+  def __call__(self, output: str) -> bool:
+    return self.regex.search(output) is None
+
+
 def not_have(pattern: str):
-  return lambda output: not re.search(pattern, output, flags=re.IGNORECASE)
+  return _NotHaveMatcher(pattern)
 
 
 def has(pattern: str):
-  return lambda output: re.search(pattern, output, flags=re.IGNORECASE)
+  return _HasMatcher(pattern)
+
+
+# Where the outputs of the commands run with a cache_ttl are saved
+OUTPUT_CACHE_DIR = os.path.expanduser("~/.cache/chre_shell_util")
+
+
+def _read_cached_output(cache_path: str, cache_ttl: float):
+  """Returns the output saved at cache_path if it is newer than cache_ttl seconds."""
+  try:
+    if time.time() - os.path.getmtime(cache_path) > cache_ttl:
+      return None
+    # newline="" keeps the \r\n line endings of the terminal output as is
+    with open(cache_path, "r", newline="") as f:
+      return f.read()
+  except OSError:
+    return None
+
+
+def _write_cached_output(cache_path: str, output: str):
+  """Saves the output at cache_path, replacing the existing one atomically."""
+  try:
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", newline="") as f:
+      f.write(output)
+    os.replace(tmp_path, cache_path)
+  except OSError as e:
+    log_w(f"Failed to cache the command output: {e}")
 
 
 class ShellSession:
   SUCCESS = "\033[32m[OK]\033[0m"
   FAILURE = "\033[31m[FAILED]\033[0m"
 
+  # Printed by the shell after each command of run_batch()
+  BATCH_SENTINEL = "__CHRE_SEP__"
+  BATCH_SENTINEL_PATTERN = re.compile(BATCH_SENTINEL + r"\d+\r?\n")
+
   def __init__(self, shell_cmd="bash", cmd_width=80, env=None):
     # Move pexpect to local import as ShellSession is the only place using it.
     import pexpect
     if env is None:
       env = {"SCRIPT_ONLY": "yes"}
     self.cmd_width = cmd_width  # Used for pretty printing
-    self.session = pexpect.spawn(shell_cmd, env=env)
+    self._is_interactive = sys.stdout.isatty()
+    # Identifies the shell and its environment in the keys of cached outputs
+    self._cache_key_prefix = (shell_cmd + repr(sorted(env.items()))).encode()
+    # With the echo off the output captured doesn't start with the command sent,
+    # and maxread lets a large output be read in fewer calls.
+    self.session = pexpect.spawn(shell_cmd, env=env, echo=False, maxread=65536)
+    # By default pexpect sleeps 50ms before sending each command
+    self.session.delaybeforesend = None
     self.session.expect(r"(.*)[$#>] ")
-    self.prompt = self.session.match.group(1).decode()
+    # The whole prompt is matched literally, which is cheaper than matching it as
+    # a regex and doesn't break on prompts containing special characters.
+    self._prompt_bytes = self.session.match.group(0)
+    self.prompt = self._prompt_bytes.decode()
 
   # When the keyword argument timeout is -1 (default), then TIMEOUT exception
   # will be raised after the default value specified by the class timeout
   # attribute ( 30s). When it is None, TIMEOUT exception will not be raised and may
   # block indefinitely until match.
+  #
+  # When cache_ttl is set, the output of a successful run is saved under
+  # OUTPUT_CACHE_DIR and returned without running cmd again for the next
+  # cache_ttl seconds. This is only meant for commands without side effects, such
+  # as querying a device property. cache_key_extra is added to the key, e.g. the
+  # content of the files the output depends on.
   def run(
-      self, cmd, is_successful=None, timeout=None, show_output=False
+      self, cmd, is_successful=None, timeout=None, show_output=False,
+      cache_ttl=None, cache_key_extra=b""
   ) -> str:
-    print(cmd.ljust(90), end="", flush=True)
+    self._write_header(f"{cmd:<90}")
     start_time = time.perf_counter()
-    output = self._execute(cmd, timeout)
+    cache_path = None
+    output = None
+    if cache_ttl is not None:
+      cache_path = self._get_cache_path(cmd, cache_key_extra)
+      output = _read_cached_output(cache_path, cache_ttl)
+    is_cached = output is not None
+    if not is_cached:
+      output = self._execute(cmd, timeout)
     has_result = is_successful is None or is_successful(output)
-    print(
-      "{:<20} {:5.2f}s".format(
-        ShellSession.SUCCESS if has_result else ShellSession.FAILURE,
-        time.perf_counter() - start_time,
-      )
-    )
+    if cache_path and has_result and not is_cached:
+      _write_cached_output(cache_path, output)
+    status = ShellSession.SUCCESS if has_result else ShellSession.FAILURE
+    sys.stdout.write(f"{status:<20} {time.perf_counter() - start_time:5.2f}s\n")
 
     if not has_result or show_output:
       print("-" * 50)
       print(output if output else "\n**NO OUTPUT**\n", end="")
       print("-" * 50 + "\n")
+    sys.stdout.flush()
 
     if not has_result:
       exit(-1)
 
     return output
 
+  def run_batch(
+      self, cmds, is_successful=None, timeout=None, show_output=False
+  ) -> list[str]:
+    """Runs several commands with a single round-trip to the shell.
+
+    The commands are sent on one line, each followed by a sentinel printed by the
+    shell, and the output captured is split at the sentinels. The time reported
+    is the total of the batch.
+
+    Args:
+      cmds: The commands to run in order. Each runs even if a previous one fails.
+      is_successful: An optional check applied to the output of each command.
+      timeout: The timeout of the whole batch, see run().
+      show_output: Whether to print the output of each command.
+
+    Returns:
+      The output of each command.
+    """
+    batch = " ; ".join(
+      f"{{ {cmd} ; }} ; printf '%s%d\\n' {ShellSession.BATCH_SENTINEL} {i}"
+      for i, cmd in enumerate(cmds)
+    )
+    start_time = time.perf_counter()
+    output = self._execute(batch, timeout)
+    elapsed = time.perf_counter() - start_time
+    outputs = ShellSession.BATCH_SENTINEL_PATTERN.split(output)[:len(cmds)]
+    _report_outputs(cmds, outputs, is_successful, show_output, elapsed)
+    return outputs
+
+  # The interval between retries starts at retry_interval and doubles after each
+  # failed attempt up to max_interval, with up to 10% of jitter added, so that a
+  # slow-to-converge condition is not polled at a constant rate.
+  #
+  # poll_fn is an optional cheap probe called after each interval, e.g. checking
+  # a device property, when cmd or is_successful is expensive. cmd is only run
+  # again once poll_fn returns a truthy value.
   def run_until_success(
-      self, cmd, is_successful, retry_interval=1, timeout=20, show_output=False
+      self, cmd, is_successful, retry_interval=1, timeout=20, show_output=False,
+      max_interval=60, poll_fn=None
   ):
-    print(f"{cmd:<{self.cmd_width}}", end="", flush=True)
+    self._write_header(f"{cmd:<{self.cmd_width}}")
     start_time = time.perf_counter()
     output = self._execute(cmd, timeout=timeout)
+    # Imported here as only the retries need it, like pexpect in __init__
+    import random
+    attempt = 0
     while not is_successful(output):
-      time.sleep(retry_interval)
+      delay = min(max_interval, retry_interval * 2 ** attempt)
+      time.sleep(delay + random.uniform(0, delay * 0.1))
+      attempt += 1
+      if poll_fn is not None and not poll_fn():
+        continue
       output = self._execute(cmd, timeout)
-    print(
-      "{:<20} {:.2f}s".format(
-        ShellSession.SUCCESS, time.perf_counter() - start_time
-      )
-    )
+    sys.stdout.write(f"{ShellSession.SUCCESS:<20} {time.perf_counter() - start_time:.2f}s\n")
     if show_output:
       print("-" * 50)
       print(output, end="")
       print("-" * 50 + "\n")
+    sys.stdout.flush()
     return output
 
+  def _write_header(self, header):
+    sys.stdout.write(header)
+    # Someone watching a terminal should see which command is being waited on.
+    # Otherwise the header is flushed together with the result of the command.
+    if self._is_interactive:
+      sys.stdout.flush()
+
+  def _get_cache_path(self, cmd, cache_key_extra):
+    # Imported here as only the cached runs need it, like pexpect in __init__
+    import hashlib
+    key = hashlib.sha256(self._cache_key_prefix + cmd.encode() + cache_key_extra).hexdigest()
+    return os.path.join(OUTPUT_CACHE_DIR, key[:2], key)
+
   def _execute(self, cmd, timeout):
     self.session.sendline(cmd)
-    self.session.expect(self.prompt, timeout=timeout)
-    return self.session.before.decode().split("\r\n", maxsplit=1)[1]
+    self.session.expect_exact(self._prompt_bytes, timeout=timeout)
+    before = self.session.before
+    # Many commands, e.g. mkdir, print nothing
+    return before.decode() if before else ""
+
+
+def _report_outputs(cmds, outputs, is_successful, show_output, elapsed):
+  """Prints the status of commands run together and exits if any failed.
+
+  Args:
+    cmds: The commands run.
+    outputs: The output of each command.
+    is_successful: An optional check applied to the output of each command.
+    show_output: Whether to print the output of each command.
+    elapsed: The time taken by all the commands, in seconds.
+  """
+  all_successful = True
+  for cmd, cmd_output in zip(cmds, outputs):
+    has_result = is_successful is None or is_successful(cmd_output)
+    all_successful = all_successful and has_result
+    status = ShellSession.SUCCESS if has_result else ShellSession.FAILURE
+    sys.stdout.write(f"{cmd:<90}{status}\n")
+    if not has_result or show_output:
+      print("-" * 50)
+      print(cmd_output if cmd_output else "\n**NO OUTPUT**\n", end="")
+      print("-" * 50 + "\n")
+  print(f"{len(cmds)} commands in {elapsed:.2f}s", flush=True)
+
+  if not all_successful:
+    exit(-1)
+
+
+class ShellPool:
+  """Runs commands on several ShellSessions in parallel.
+
+  ShellSession runs one command at a time. Independent commands, e.g. adb
+  commands for different devices, can be dispatched to one session each so that
+  they take as long as the slowest one instead of the sum of all of them.
+  """
+
+  def __init__(self, sessions):
+    self.sessions = list(sessions)
+
+  def dispatch(
+      self, cmds, is_successful=None, timeout=None, show_output=False
+  ) -> list[str]:
+    """Runs cmds[i] on sessions[i] concurrently and waits for all of them.
+
+    All the commands are sent first, then the output of the sessions is read as
+    it becomes available until each one shows its prompt again.
+
+    Args:
+      cmds: The commands to run, one per session at most.
+      is_successful: An optional check applied to the output of each command.
+      timeout: The number of seconds to wait for all the commands, or None to
+        wait indefinitely.
+      show_output: Whether to print the output of each command.
+
+    Returns:
+      The output of each command.
+    """
+    import selectors
+    import pexpect
+
+    if len(cmds) > len(self.sessions):
+      fatal_error(f"{len(cmds)} commands for {len(self.sessions)} sessions")
+
+    start_time = time.perf_counter()
+    outputs = [None] * len(cmds)
+    received = []
+    with selectors.DefaultSelector() as selector:
+      for i, (session, cmd) in enumerate(zip(self.sessions, cmds)):
+        # Start from what pexpect already read past the previous prompt
+        received.append(bytearray(session.session.buffer))
+        session.session.buffer = b""
+        session.session.sendline(cmd)
+        selector.register(session.session.child_fd, selectors.EVENT_READ, i)
+
+      while selector.get_map():
+        remaining = None
+        if timeout is not None:
+          remaining = timeout - (time.perf_counter() - start_time)
+          if remaining <= 0:
+            fatal_error(f"Commands timed out after {timeout}s: {cmds}")
+        for key, _ in selector.select(remaining):
+          i = key.data
+          pexpect_session = self.sessions[i].session
+          try:
+            received[i] += pexpect_session.read_nonblocking(pexpect_session.maxread, timeout=0)
+          except pexpect.EOF:
+            fatal_error(f"Shell exited before the command completed: {cmds[i]}")
+          prompt = self.sessions[i]._prompt_bytes
+          end = received[i].find(prompt)
+          if end >= 0:
+            outputs[i] = received[i][:end].decode()
+            # Keep what follows the prompt for the next command, like expect does
+            pexpect_session.buffer = bytes(received[i][end + len(prompt):])
+            selector.unregister(key.fd)
+
+    _report_outputs(cmds, outputs, is_successful, show_output,
+                    time.perf_counter() - start_time)
+    return outputs
+
+
+@functools.lru_cache(maxsize=None)
+def get_session(shell_cmd: str = "bash") -> ShellSession:
+  """Returns a ShellSession running shell_cmd, shared by all the callers.
+
+  Spawning a shell and waiting for its prompt is relatively slow, so a session
+  is only created the first time a shell_cmd is requested and reused afterwards.
+
+  Args:
+    shell_cmd: The shell to run.
+
+  Returns:
+    The ShellSession of shell_cmd with the default environment.
+  """
+  return ShellSession(shell_cmd)